@@ -1,10 +1,11 @@
-from random import random
+import sys
+from random import random, randint, seed as random_seed
 from PIL import Image, ImageDraw
 
 from MicroGrid import *
 from tools import *
 
-def create_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str):
+def create_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, compression: Optional[str] = None):
 	ny = len(MGs)
 	nx = len(MGs[0])
 	ntotal = nx * ny # how many microgrids are there
@@ -40,7 +41,7 @@ def create_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str):
 
 	# write out the adjacency matrix file as space seperated 1's and 0's
 	# one row/column per MG
-	with open(filename, 'w') as fout:
+	with open_file(filename, 'w', compression) as fout:
 		for rowIdx in range(ntotal):
 			if rowIdx > 0:
 				fout.write("\n")
@@ -134,12 +135,25 @@ def write_network_size(MGs: list[list[MicroGrid]], filename: str):
 	with open(filename, "w") as fout:
 		fout.write(f"{ny}\n{nx}\n")
 
+def write_parameters(params: dict[str, int|float], filename: str):
+	""" Writes the parameters used to generate the network, one "name value" pair per line. """
+	with open(filename, "w") as fout:
+		for name, value in params.items():
+			fout.write(f"{name} {value}\n")
+
 if __name__ == "__main__":
 	MGs: list[list[MicroGrid]] = []
 
 	# how many microgrids
 	nx, ny = 10, 10
 
+	# how likely each microgrid is to connect to its neighbors, in percent
+	side_conn_prob, corner_conn_prob = 90, 15
+
+	# seed the random positions and connections, so that this network can be generated again
+	seed = int(sys.argv[2]) if len(sys.argv) > 2 else randint(0, 2**31-1)
+	random_seed(seed)
+
 	# how far apart to space the microgrids, in km
 	avg_dist = 10
 	rand_dist = 1
@@ -152,7 +166,7 @@ if __name__ == "__main__":
 			# create a microgrid with a pseudo random position and random connections
 			MG = MicroGrid(x, y,
 				           avg_dist*x + get_rand_dist(), avg_dist*y + get_rand_dist(),
-				           side_conn_prob=90, corner_conn_prob=15)
+				           side_conn_prob=side_conn_prob, corner_conn_prob=corner_conn_prob)
 			MGs[y].append(MG)
 			
 			# if this microgrid is on the edge of our network, then crop outside connections
@@ -169,8 +183,12 @@ if __name__ == "__main__":
 				MG.use_existing_connections(MGs[y-1][x], dir="north")
 
 	# save out to files
-	draw_adjacency_matrix(MGs,   os.path.join(dir(__file__), "../output", "10_adjacency_matrix.png"))
-	create_adjacency_matrix(MGs, os.path.join(dir(__file__), "../output", "10_adjacency_matrix.txt"))
-	write_node_coordinates(MGs,  os.path.join(dir(__file__), "../output", "10_node_coordinates.txt"))
-	write_encoded_mgs(MGs,       os.path.join(dir(__file__), "../output", "10_mgs_encoded.csv"))
-	write_network_size(MGs,      os.path.join(dir(__file__), "../output", "10_network_size.txt"))
\ No newline at end of file
+	output_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(dir(__file__), "../output")
+	compression = None # None, "gzip", or "lzma". Note that matrix-topology.cc can only read a plain adjacency matrix.
+	draw_adjacency_matrix(MGs,   os.path.join(output_dir, "10_adjacency_matrix.png"))
+	create_adjacency_matrix(MGs, os.path.join(output_dir, "10_adjacency_matrix.txt"), compression)
+	write_node_coordinates(MGs,  os.path.join(output_dir, "10_node_coordinates.txt"))
+	write_encoded_mgs(MGs,       os.path.join(output_dir, "10_mgs_encoded.csv"), compression)
+	write_network_size(MGs,      os.path.join(output_dir, "10_network_size.txt"))
+	write_parameters({ "nx": nx, "ny": ny, "side_conn_prob": side_conn_prob, "corner_conn_prob": corner_conn_prob, "seed": seed },
+	                 os.path.join(output_dir, "10_parameters.txt"))
\ No newline at end of file
@@ -4,13 +4,18 @@ import os
 import sys
 import glob
 import re
+import shutil
+import subprocess
+
+from tools import *
 
 
 def main():
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} scratch_dir")
+        print(f"Usage: {sys.argv[0]} scratch_dir [gzip|lzma]")
         return
     scratch_dir = sys.argv[1]
+    compression = sys.argv[2] if len(sys.argv) > 2 else None
     os.chdir(os.path.join(scratch_dir, "output"))
     print("Converting pcap files to CSV format")
 
@@ -28,7 +33,17 @@ def main():
 
         # all tshark output options:
         # -e ip.src -e ip.dst -e ip.len -e ip.flags.df -e ip.flags.mf -e ip.fragment -e ip.fragment.count -e ip.fragments -e ip.ttl -e ip.proto -e tcp.window_size -e tcp.ack -e tcp.seq -e tcp.len -e tcp.stream -e tcp.urgent_pointer -e tcp.flags -e tcp.analysis.ack_rtt -e tcp.segments -e tcp.reassembled.length -e ssl.handshake -e ssl.record -e ssl.record.content_type -e ssl.handshake.cert_url.url_len -e ssl.handshake.certificate_length -e ssl.handshake.cert_type -e ssl.handshake.cert_type.type -e ssl.handshake.cert_type.types -e ssl.handshake.cert_type.types_len -e ssl.handshake.cert_types -e ssl.handshake.cert_types_count -e dtls.handshake.extension.len -e dtls.handshake.extension.type -e dtls.handshake.session_id -e dtls.handshake.session_id_length -e dtls.handshake.session_ticket_length -e dtls.handshake.sig_hash_alg_len -e dtls.handshake.sig_len -e dtls.handshake.version -e dtls.heartbeat_message.padding -e dtls.heartbeat_message.payload_length -e dtls.heartbeat_message.payload_length.invalid -e dtls.record.content_type -e dtls.record.content_type -e dtls.record.length -e dtls.record.sequence_number -e dtls.record.version -e dtls.change_cipher_spec -e dtls.fragment.count -e dtls.handshake.cert_type.types_len -e dtls.handshake.certificate_length -e dtls.handshake.certificates_length -e dtls.handshake.cipher_suites_length -e dtls.handshake.comp_methods_length -e dtls.handshake.exponent_len -e dtls.handshake.extension.len -e dtls.handshake.extensions_alpn_str -e dtls.handshake.extensions_alpn_str_len -e dtls.handshake.extensions_key_share_client_length -e http.request -e udp.port -e frame.time_relative -e frame.time_delta -e tcp.time_relative -e tcp.time_delta
-        os.system(f"tshark -r {file} -T fields -e frame.time_relative -e ip.src -e ip.dst -e ip.len -e udp.port -E header=y -E separator=, -E quote=d -E occurrence=f > 20_pcap_ppp-{node}-{interface}.csv")
+        tshark_args = f"tshark -r {file} -T fields -e frame.time_relative -e ip.src -e ip.dst -e ip.len -e udp.port -E header=y -E separator=, -E quote=d -E occurrence=f"
+        csvfile = f"20_pcap_ppp-{node}-{interface}.csv"
+        with open_file(csvfile, "wb", compression) as fout:
+            tshark = subprocess.Popen(tshark_args.split(" "), stdout=subprocess.PIPE)
+            shutil.copyfileobj(tshark.stdout, fout, BLOCK_SIZE)
+            returncode = tshark.wait()
+
+        # don't leave a truncated csv file behind to be mistaken for a good one
+        if returncode != 0:
+            os.remove(csvfile)
+            raise RuntimeError(f"tshark failed with exit code {returncode} for {file}!")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
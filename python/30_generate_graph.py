@@ -1,9 +1,12 @@
 # generate graphs from the parsed pcaps from 20_parse_pcaps.py
 import glob
+import heapq
 import os
 import pickle
 import re
 import sys
+from array import array
+from collections import deque
 import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
@@ -11,6 +14,9 @@ import matplotlib.colors as mcolors
 import numpy as np
 
 from python.MicroGrid import *
+from python.tools import open_file
+from python.results_catalog import ResultsCatalog, read_parameters, get_results_id
+from python.ns3_trace import read_node_interfaces
 
 constant_internet_rate = 50 * 1000 # 10KBps for worst-case scenario internet traffic, viewing cameras or the such
 
@@ -31,7 +37,7 @@ def parse_pcaps(files: list[str]) -> dict[int, list[list[float, int]]]:
         node = int(match.groups()[0])
         interface = int(match.groups()[1])
 
-        with open(file, "r") as fin:
+        with open_file(file, "r") as fin:
             header = None
             for line in fin:
                 line = line.strip()
@@ -53,6 +59,108 @@ def parse_pcaps(files: list[str]) -> dict[int, list[list[float, int]]]:
 
     return ret
 
+def get_flow_matrix(files: list[str], addr_nodes: dict[str, int], at_node: Optional[int] = None) -> dict[str, np.ndarray]:
+    """ Accumulates the bytes and packets sent between each pair of nodes from the parsed pcap files.
+
+    Arguments
+    ---------
+        files: the "20_pcap_ppp-*.csv" files
+        addr_nodes: the map from ip address to node index, from read_node_interfaces()
+        at_node: if None, then each packet is counted once, on its source node. Otherwise only
+                 packets captured on this node's interfaces are counted, once per interface (the
+                 same way parse_pcaps() attributes bytes to nodes).
+
+    Returns
+    -------
+        dict( "src"|"dst"|"bytes"|"packets"|"peak_rate", array ), with one entry per flow. The
+        peak_rate is the maximum bytes seen for that flow within a 1 second window. """
+    rconn = re.compile(r"20_pcap_ppp-(\d+)-(\d+)\.csv")
+
+    # ip address strings are interned into node ids, so each distinct string is only looked up once
+    addr_ids: dict[str, int] = {}
+    def intern_addr(saddr: str) -> int:
+        addr_id = addr_ids.get(saddr)
+        if addr_id is None:
+            addr_id = addr_nodes.get(saddr.strip('"'), -1)
+            addr_ids[saddr] = addr_id
+        return addr_id
+
+    # sparse (src, dst) -> packet times and sizes
+    flow_times: dict[tuple[int, int], array] = {}
+    flow_sizes: dict[tuple[int, int], array] = {}
+
+    for file in files:
+        match = rconn.match(os.path.basename(file))
+        if match is None:
+            continue
+        node = int(match.groups()[0])
+        if at_node is not None and node != at_node:
+            continue
+
+        with open_file(file, "r") as fin:
+            header = None
+            for line in fin:
+                line = line.strip()
+                if header is None:
+                    header = line
+                    continue
+                if "," not in line:
+                    continue
+
+                # example line
+                # "0.000000000", "10.0.0.2", "10.0.0.1", "540"
+                parts = line.split(",")
+                src = intern_addr(parts[1])
+                if at_node is None and src != node:
+                    continue
+                flow = (src, intern_addr(parts[2]))
+                if flow not in flow_times:
+                    flow_times[flow] = array("d")
+                    flow_sizes[flow] = array("q")
+                flow_times[flow].append(float(parts[0].strip('"')))
+                flow_sizes[flow].append(int(parts[3].strip('"'))+2) # +2 for bytes on the wire
+
+    # collapse each flow into its totals and peak rate
+    flows = sorted(flow_times.keys())
+    ret = {
+        "src":       np.array([flow[0] for flow in flows], dtype=np.int32),
+        "dst":       np.array([flow[1] for flow in flows], dtype=np.int32),
+        "bytes":     np.zeros(len(flows), dtype=np.int64),
+        "packets":   np.zeros(len(flows), dtype=np.int64),
+        "peak_rate": np.zeros(len(flows), dtype=np.int64),
+    }
+    for i, flow in enumerate(flows):
+        times = np.frombuffer(flow_times[flow], dtype=np.float64)
+        sizes = np.frombuffer(flow_sizes[flow], dtype=np.int64)
+        order = np.argsort(times, kind="stable")
+        times, sizes = times[order], sizes[order]
+
+        # sum of sizes within [time-1, time] for every packet, same as get_node_sliding_windows()
+        cumsizes = np.concatenate(([0], np.cumsum(sizes)))
+        window_starts = np.searchsorted(times, times-1, side="left")
+        window_sums = cumsizes[1:] - cumsizes[window_starts]
+
+        ret["bytes"][i] = cumsizes[-1]
+        ret["packets"][i] = len(sizes)
+        ret["peak_rate"][i] = window_sums.max()
+
+    return ret
+
+def draw_flow_heatmap(flows: dict[str, np.ndarray], nnodes: int, filename: str, value: str = "bytes"):
+    """ Saves a src node x dst node heatmap of the given flow value ("bytes", "packets", or "peak_rate"). """
+    known = (flows["src"] >= 0) & (flows["dst"] >= 0)
+    matrix = np.zeros((nnodes, nnodes), dtype=np.int64)
+    matrix[flows["src"][known], flows["dst"][known]] = flows[value][known]
+
+    fig = plt.figure()
+    plt.imshow(matrix, cmap="RdYlGn_r", interpolation="nearest")
+    plt.colorbar(label=value)
+    plt.xlabel("Destination Node")
+    plt.ylabel("Source Node")
+    plt.title(f"Flow {value}")
+    plt.savefig(filename)
+    plt.close(fig)
+
 def get_node_sliding_windows(pcap_files):
     # get the bytes used per node from the pcap files
     parsed_pcaps = parse_pcaps(pcap_files)
@@ -98,6 +206,280 @@ def get_node_sliding_windows(pcap_files):
 
     return node_windows
 
+def iter_pcap_packets(file: str, node: int):
+    """ Yields (time, packet size, node) for every packet in one of the "20_pcap_ppp-*.csv" files. """
+    with open_file(file, "r") as fin:
+        header = None
+        for line in fin:
+            line = line.strip()
+            if header is None:
+                header = line
+                continue
+            if "," not in line:
+                continue
+
+            parts = [s.strip('"') for s in line.split(",")]
+            yield float(parts[0]), int(parts[3])+2, node # +2 for bytes on the wire
+
+def iter_network_windows(files: list[str], region_of_node: Callable[[int], int]):
+    """ Streams the sliding 1-second window bitrate, summed over all nodes in each region.
+
+    Each file is already sorted by time, so the files are k-way merged instead of being loaded
+    into memory. Memory use depends on the number of files plus the packets within the current
+    1-second window of each region, and not on the total number of packets.
+
+    Arguments
+    ---------
+        files: the "20_pcap_ppp-*.csv" files
+        region_of_node: returns the region index for the given node index
+
+    Yields
+    ------
+        (time, region, bitrate) every time a region's window changes. The times are in order
+        within each region, but a region's window removals can be earlier than events already
+        yielded for other regions. The bitrate doesn't include the constant_internet_rate. """
+    rconn = re.compile(r"20_pcap_ppp-(\d+)-(\d+)\.csv")
+    iterators = []
+    for file in files:
+        match = rconn.match(os.path.basename(file))
+        if match is None:
+            continue
+        iterators.append(iter_pcap_packets(file, int(match.groups()[0])))
+
+    # per region: the packets within the window, and the sum of their sizes
+    windows: dict[int, deque[tuple[float, int]]] = {}
+    window_sums: dict[int, int] = {}
+
+    for time, nbytes, node in heapq.merge(*iterators, key=lambda packet: packet[0]):
+        region = region_of_node(node)
+        if region not in windows:
+            windows[region] = deque()
+            window_sums[region] = 0
+        window = windows[region]
+
+        # remove values no longer within the window, same as get_node_sliding_windows()
+        while len(window) > 0 and window[0][0] < time-1:
+            old_time, old_nbytes = window.popleft()
+            window_sums[region] -= old_nbytes
+            yield old_time+1, region, window_sums[region]
+
+        # add this packet to the window
+        window.append((time, nbytes))
+        window_sums[region] += nbytes
+        yield time, region, window_sums[region]
+
+def get_network_sliding_windows(files: list[str], nx: int, ny: int, region_size: Optional[int] = None, bin_size: float = 0.01) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """ Get the network-wide sliding window bitrate, or the bitrate per region of the grid.
+
+    The window values from iter_network_windows() are accumulated straight into fixed time bins,
+    so that the result grows with the simulated time and not with the number of packets.
+
+    Arguments
+    ---------
+        nx, ny: the size of the network
+        region_size: if not None, then split the grid into region_size x region_size squares of nodes
+        bin_size: the width of each time bin, in seconds
+
+    Returns
+    -------
+        dict( region, (bin start times, max bitrate within each bin) ), where the regions are
+        numbered row by row. The network-wide bitrate is region 0 when region_size is None. """
+    if region_size is None:
+        region_of_node = lambda nodeIdx: 0
+        region_nnodes = {0: nx*ny}
+    else:
+        nregions_x = int((nx + region_size - 1) / region_size)
+        def region_of_node(nodeIdx: int) -> int:
+            nodex = int(nodeIdx % nx)
+            nodey = int((nodeIdx - nodex) / nx)
+            return int(nodey / region_size) * nregions_x + int(nodex / region_size)
+        region_nnodes: dict[int, int] = {}
+        for nodeIdx in range(nx*ny):
+            region = region_of_node(nodeIdx)
+            region_nnodes[region] = region_nnodes.get(region, 0) + 1
+
+    # per region: the max window value within each bin, and the latest window value
+    bin_maxes: dict[int, array] = {}
+    last_values: dict[int, int] = {}
+    for time, region, bitrate in iter_network_windows(files, region_of_node):
+        if region not in bin_maxes:
+            bin_maxes[region] = array("q")
+            last_values[region] = 0
+        maxes = bin_maxes[region]
+
+        # the window holds its last value until this event, which is in order within the region
+        timebin = int(time / bin_size)
+        if len(maxes) <= timebin:
+            maxes.extend([last_values[region]] * (timebin+1 - len(maxes)))
+        maxes[timebin] = max(maxes[timebin], bitrate)
+        last_values[region] = bitrate
+
+    ret: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+    for region, maxes in bin_maxes.items():
+        bitrates = np.frombuffer(maxes, dtype=np.int64) + constant_internet_rate*region_nnodes[region]
+        ret[region] = (np.arange(len(maxes)) * bin_size, bitrates)
+
+    return ret
+
+def get_time_weighted_mean(times: list[float], values: list[int]) -> float:
+    """ The mean of a sliding window series, weighting each value by how long it held for.
+
+    The window series has a value for every packet arrival and removal, so a plain average of its
+    values would be biased towards bursts of packets. """
+    times = np.asarray(times)
+    values = np.asarray(values, dtype=float)
+    duration = times[-1] - times[0]
+    if duration <= 0:
+        return float(values.max())
+    return float(np.sum(values[:-1] * np.diff(times)) / duration)
+
+def get_interface_peers(adjacency_filename: str) -> dict[tuple[int, int], int]:
+    """ Figures out which node is on the other end of each of the pcap files' interfaces.
+
+    matrix-topology.cc creates the links in row order of the adjacency matrix, and device 0 of
+    every node is its loopback device, so the n-th link of a node is its device n.
+
+    Returns
+    -------
+        dict( (node, device), peer node ) """
+    ret: dict[tuple[int, int], int] = {}
+    ndevices: dict[int, int] = {}
+    with open_file(adjacency_filename, "r") as fin:
+        for i, line in enumerate(fin):
+            for j, connection in enumerate(line.split()):
+                if connection != "1":
+                    continue
+                for node, peer in [(i, j), (j, i)]:
+                    ndevices[node] = ndevices.get(node, 0) + 1
+                    ret[(node, ndevices[node])] = peer
+    return ret
+
+def get_link_stats(files: list[str], interface_peers: dict[tuple[int, int], int]) -> list[tuple[int, int, int, int, float]]:
+    """ Summarizes the traffic on each interface.
+
+    Returns
+    -------
+        [(node, peer node, bytes, packets, peak rate)+], where the peak rate is the maximum bytes
+        within a 1 second window """
+    rconn = re.compile(r"20_pcap_ppp-(\d+)-(\d+)\.csv")
+    ret: list[tuple[int, int, int, int, float]] = []
+
+    for file in files:
+        match = rconn.match(os.path.basename(file))
+        if match is None:
+            continue
+        node = int(match.groups()[0])
+        interface = int(match.groups()[1])
+        if (node, interface) not in interface_peers:
+            continue
+
+        times = array("d")
+        sizes = array("q")
+        for time, nbytes, _ in iter_pcap_packets(file, node):
+            times.append(time)
+            sizes.append(nbytes)
+        if len(times) == 0:
+            continue
+
+        # sum of sizes within [time-1, time] for every packet, same as get_flow_matrix()
+        times_np = np.frombuffer(times, dtype=np.float64)
+        cumsizes = np.concatenate(([0], np.cumsum(np.frombuffer(sizes, dtype=np.int64))))
+        window_starts = np.searchsorted(times_np, times_np-1, side="left")
+        peak_rate = float((cumsizes[1:] - cumsizes[window_starts]).max())
+
+        ret.append((node, interface_peers[(node, interface)], int(cumsizes[-1]), len(times), peak_rate))
+
+    return ret
+
+def get_binned_intensities(node_windows: dict[int, list[list[float], list[int]]], nnodes: int, bin_size: float = 0.1) -> tuple[np.ndarray, np.ndarray]:
+    """ Collapses each node's sliding window series into fixed time bins, for animating.
+
+    The series is a step function: its value holds from one window event until the next. So each
+    bin gets the max of the value carried in from before the bin starts and of any events inside the bin.
+
+    Returns
+    -------
+        (bin start times, array[bin, nodeIdx] of the max bitrate within each bin). Nodes without any
+        packets are NaN, bins before a node's first packet have the constant_internet_rate. """
+    tmax = max([max(ts_persec[0]) for ts_persec in node_windows.values() if len(ts_persec[0]) > 0], default=0)
+    nbins = int(tmax / bin_size) + 1
+    bin_starts = np.arange(nbins) * bin_size
+    intensities = np.full((nbins, nnodes), np.nan)
+
+    for nodeIdx, ts_persec in node_windows.items():
+        times = np.asarray(ts_persec[0])
+        values = np.asarray(ts_persec[1], dtype=float)
+
+        node_intensities = np.full(nbins, float(constant_internet_rate))
+        if len(times) == 0:
+            intensities[:, nodeIdx] = node_intensities
+            continue
+
+        # the value carried in from the last event at or before each bin start
+        last_events = np.searchsorted(times, bin_starts, side="right") - 1
+        carried = last_events >= 0
+        node_intensities[carried] = values[last_events[carried]]
+
+        # plus the events within each bin
+        bins = (times / bin_size).astype(int)
+        np.maximum.at(node_intensities, bins, values)
+        intensities[:, nodeIdx] = node_intensities
+
+    return bin_starts, intensities
+
+def decimate_series(times: list[float], values: list[int], nbuckets: int) -> tuple[np.ndarray, np.ndarray]:
+    """ Reduces a time series to at most about 2*nbuckets points for plotting.
+
+    The series is split into nbuckets equal time buckets, and only the minimum and maximum
+    points of each bucket are kept, so that peaks still show up in the plot.
+
+    Arguments
+    ---------
+        times: the time of each value, in increasing order
+        values: the values to decimate
+        nbuckets: how many buckets to split the series into, typically the plot width in pixels
+
+    Returns
+    -------
+        (times, values) of the kept points, in time order """
+    times = np.asarray(times)
+    values = np.asarray(values)
+    if len(times) <= 2*nbuckets:
+        return times, values
+
+    # assign each point to a bucket
+    edges = np.linspace(times[0], times[-1], nbuckets+1)
+    buckets = np.clip(np.searchsorted(edges, times, side="right")-1, 0, nbuckets-1)
+
+    # sort by bucket, then by value, so the first and last points of each bucket are its min and max
+    order = np.lexsort((values, buckets))
+    sorted_buckets = buckets[order]
+    firsts = np.flatnonzero(np.diff(sorted_buckets, prepend=-1))
+    lasts = np.append(firsts[1:]-1, len(order)-1)
+
+    keep = np.unique(np.concatenate((order[firsts], order[lasts], [0, len(times)-1])))
+    return times[keep], values[keep]
+
+def get_decimated_windows(node_windows: dict[int, list[list[float], list[int]]], nbuckets: int, picklefile: str = "node_windows_decimated.pickle") -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """ Returns the decimate_series() version of every node's window series.
+
+    Results are cached in picklefile per nbuckets, and are recomputed when the picklefile is
+    older than the "node_sliding_windows.pickle" file. """
+    cached: dict[int, dict[int, tuple[np.ndarray, np.ndarray]]] = {}
+    windowsfile = "node_sliding_windows.pickle"
+    if os.path.exists(picklefile) and (not os.path.exists(windowsfile) or os.stat(picklefile).st_mtime > os.stat(windowsfile).st_mtime):
+        with open(picklefile, "rb") as fin:
+            cached = pickle.load(fin)
+
+    if nbuckets not in cached:
+        cached[nbuckets] = {}
+        for nodeIdx, ts_persec in node_windows.items():
+            cached[nbuckets][nodeIdx] = decimate_series(ts_persec[0], ts_persec[1], nbuckets)
+        with open(picklefile, "wb") as fout:
+            pickle.dump(cached, fout)
+
+    return cached[nbuckets]
+
 def main():
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} output_dir")
@@ -106,8 +488,12 @@ def main():
     colors = [c for c in mcolors.TABLEAU_COLORS]
     degrees = list(range(1, 6))
 
-    # "all_degrees", "bitrate_per_node", "bitrate_per_node_norm", "bandwidth_by_degrees"
+    # "all_degrees", "bitrate_per_node", "bitrate_per_node_norm", "bandwidth_by_degrees", "network_bandwidth"
     which_plot = "bandwidth_by_degrees"
+    accumulate_flows = False # also build the node-to-node flow matrix and heatmap
+    animate = False # also save the bitrate over time as 30_adjacency_matrix.gif
+    catalog_file = None # if set, record the results in this sqlite catalog, eg os.path.join(scratch_dir, "30_results.sqlite")
+    catalog = ResultsCatalog(catalog_file) if catalog_file is not None else None
     highest_vals = []
 
     # evaluate for each of our output directories
@@ -137,6 +523,18 @@ def main():
             ny = int(fin.readline())
             nx = int(fin.readline())
 
+        # accumulate the node-to-node flows (or load cached results)
+        if accumulate_flows:
+            flowsfile = "flow_matrix.pickle"
+            if os.path.exists(flowsfile) and os.stat(flowsfile).st_mtime > os.stat(files[0]).st_mtime:
+                with open(flowsfile, "rb") as fin:
+                    flows: dict[str, np.ndarray] = pickle.load(fin)
+            else:
+                flows = get_flow_matrix(files, read_node_interfaces("20_node_interfaces.txt"))
+                with open(flowsfile, "wb") as fout:
+                    pickle.dump(flows, fout)
+            draw_flow_heatmap(flows, nx*ny, "30_flow_matrix.png")
+
         # get the max values per node
         max_vals = [[], []]
         for nodeIdx, ts_persec in node_windows.items():
@@ -147,12 +545,27 @@ def main():
             max_vals[0].append([nodex, nodey])
             max_vals[1].append(mv)
 
+        # record this run in the catalog, unless these results are already there (getting the link stats re-reads every pcap file)
+        if catalog is not None and not catalog.has_run(os.getcwd(), get_results_id(picklefile)):
+            node_stats = []
+            for nodeIdx, ts_persec in node_windows.items():
+                nodex = int(nodeIdx % nx)
+                nodey = int((nodeIdx - nodex) / nx)
+                node_stats.append((nodeIdx, nodex, nodey, max(ts_persec[1]), get_time_weighted_mean(ts_persec[0], ts_persec[1])))
+            link_stats = get_link_stats(files, get_interface_peers("10_adjacency_matrix.txt"))
+            params = read_parameters(".")
+            params["ndegrees"] = ndegrees # 10_n_degrees.txt is optional, but the output directory always says
+            catalog.add_run(os.getcwd(), get_results_id(picklefile), params, node_stats, link_stats)
+
         # overlay the bitrate on top of the network topology graph
         MGs = read_encoded_mgs("10_mgs_encoded.csv")
         for i in range(len(max_vals[0])):
             nodexy, mv = max_vals[0][i], max_vals[1][i]
             MGs[nodexy[1]][nodexy[0]].intensity = mv
         draw_adjacency_matrix(MGs, "30_adjacency_matrix.png", max(max_vals[1]))
+        if animate:
+            bin_times, intensities = get_binned_intensities(node_windows, nx*ny)
+            draw_adjacency_animation(MGs, intensities, "30_adjacency_matrix.gif", max(max_vals[1]))
 
         # report the max N nodes
         N = 5
@@ -171,6 +584,7 @@ def main():
         plotSaveName = ""
         plotAllNodes = False
         plotHighestVal = False
+        plotNetwork = False
         if which_plot == "all_degrees":
             plt.subplot(3, 2, ndegrees)
             plt.title(f"{ndegrees} Degrees")
@@ -196,13 +610,26 @@ def main():
             plotAllNodes = True
         if which_plot == "bandwidth_by_degrees":
             plotHighestVal = True
+        if which_plot == "network_bandwidth":
+            plt.subplot(1, 1, 1)
+            plotNetwork = True
 
         # graph each node
         if plotAllNodes:
-            for nodeIdx, ts_persec in node_windows.items():
+            # there's no need to plot more than a couple of points per pixel
+            nbuckets = max(int(plt.gca().get_window_extent().width), 1)
+            decimated_windows = get_decimated_windows(node_windows, nbuckets)
+            for nodeIdx, ts_persec in decimated_windows.items():
                 color = colors[nodeIdx % len(colors)]
                 plt.plot(ts_persec[0], ts_persec[1], color=color)
 
+        # graph the total bandwidth of the whole network
+        if plotNetwork:
+            network_windows = get_network_sliding_windows(files, nx, ny)
+            nbuckets = max(int(plt.gca().get_window_extent().width), 1)
+            times, bitrates = decimate_series(network_windows[0][0], network_windows[0][1], nbuckets)
+            plt.plot(times, bitrates, color=colors[(ndegrees-1) % len(colors)])
+
         # graph just the highest value
         if plotHighestVal:
             highest_vals.append(max_vals_n[0][1])
@@ -220,17 +647,33 @@ def main():
         plt.title("Maximum Bandwidth Usage By Degree")
         # print(highest_vals)
         # print(np.polyfit(degrees, highest_vals, 2)) # [ 484076.28571429 -555146.51428572  250090.40000002]
+        if catalog is not None:
+            # average over every run in the catalog, instead of just this set of runs
+            peak_by_degree = catalog.peak_by_degree()
+            highest_vals = [peak_by_degree.get(degree, highest_vals[i]) for i, degree in enumerate(degrees)]
         poly = [4.8e5*(degree**2) + -5.5e5*(degree) + 2.5e5 for degree in degrees]
         plt.plot(degrees, poly, color=colors[1])
         plt.plot(degrees, highest_vals, color=colors[0])
         plt.legend(["4.8e5*d^2 - 5.5e5*d + 2.5e5", "Simulated Values"])
 
+    # graph the network bandwidths
+    if which_plot == "network_bandwidth":
+        plt.xlabel("Seconds")
+        plt.ylabel("Bytes")
+        plt.title("Network Bandwidth Usage By Degree")
+        plt.legend([f"{ndegrees} Degrees" for ndegrees in degrees])
+
     # save the graph part 2, electric boogaloo
     os.chdir(scratch_dir)
     if which_plot == "all_degrees":
         plt.savefig("30_all_degrees.png")
     if which_plot == "bandwidth_by_degrees":
         plt.savefig("30_bandwidth_by_degrees.png")
+    if which_plot == "network_bandwidth":
+        plt.savefig("30_network_bandwidth.png")
+
+    if catalog is not None:
+        catalog.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
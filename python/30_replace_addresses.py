@@ -11,6 +11,8 @@
 import os
 import sys
 
+from tools import *
+
 def get_addrs_matrix(addr_lines):
     """ Returns the current address name for interface from node i --to--> i, and the proposed new name. """
     ntotal = len(addr_lines)
@@ -35,16 +37,17 @@ def get_addrs_matrix(addr_lines):
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} scratch_dir")
+        print(f"Usage: {sys.argv[0]} scratch_dir [gzip|lzma]")
     scratch_dir = sys.argv[1]
+    compression = sys.argv[2] if len(sys.argv) > 2 else None
 
-    with open(os.path.join(scratch_dir, "output", "20_node_interfaces.txt"), "r") as fin:
+    with open_file(os.path.join(scratch_dir, "output", "20_node_interfaces.txt"), "r") as fin:
         addr_lines = fin.readlines()
     
     # get the new addresses, and replace them in the new trace file
-    with open(os.path.join(scratch_dir, "output", "20_n-node-ppp.tr"), "r") as fin:
+    with open_file(os.path.join(scratch_dir, "output", "20_n-node-ppp.tr"), "r") as fin:
         addrs_matrix = get_addrs_matrix(addr_lines)
-        with open(os.path.join(scratch_dir, "output", "30_n-node-ppp.tr"), "w") as fout:
+        with open_file(os.path.join(scratch_dir, "output", "30_n-node-ppp.tr"), "w", compression) as fout:
             fout.write(f"# This file was generated with \"python {' '.join(sys.argv)}\"\n")
             for line in fin:
                 oline = line
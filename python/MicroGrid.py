@@ -1,4 +1,5 @@
 from PIL import ImageColor, Image, ImageDraw # pip install Pillow
+import numpy as np
 
 from tools import *
 
@@ -182,19 +183,19 @@ class MicroGrid:
 
 		return mg, sval
 
-def write_encoded_mgs(MGs: list[list[MicroGrid]], filename: str):
+def write_encoded_mgs(MGs: list[list[MicroGrid]], filename: str, compression: Optional[str] = None):
 	version = 1
 	vals = ["MGs", version, len(MGs), len(MGs[0])]
 	strparts = [str(n) for n in vals]
 
-	with open(filename, "w") as fout:
+	with open_file(filename, "w", compression) as fout:
 		fout.write(",".join(strparts) + "\n")
 		for row in MGs:
 			for mg in row:
 				fout.write(mg.encode() + "\n")
 
 def read_encoded_mgs(filename: str) -> list[list[MicroGrid]]:
-	with open(filename, "r") as fin:
+	with open_file(filename, "r") as fin:
 		sval = fin.readline()
 
 		# verify the string value is a list of microgrids
@@ -214,17 +215,28 @@ def read_encoded_mgs(filename: str) -> list[list[MicroGrid]]:
 		for y in range(ny):
 			row: list[MicroGrid] = []
 			for x in range(nx):
-				mgval, sval = MicroGrid.decode(fin.readline())
+				mgval, sval = MicroGrid.decode(fin.readline().rstrip("\n"))
 				row.append(mgval)
 			ret.append(row)
 
 		return ret
 
+def intensity_color(intensity: float, max_intensity: float) -> tuple[int, int, int]:
+	""" Green for no bandwidth, red for max_intensity. """
+	r = int(255*(intensity/max_intensity))
+	g = 255-r
+	return (r, g, 0)
+
 def draw_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, max_intensity: Optional[int] = None):
+	rasterize_adjacency_matrix(MGs, max_intensity).save(filename)
+
+def adjacency_text_lines(MGs: list[list[MicroGrid]]) -> list[str]:
+	""" Returns the MG connections as text, with one character per 20x20 pixel cell of the adjacency matrix image.
+
+	MGs are "*", and connections are one of "-", "|", "\\", "/", or "X". """
 	ny = len(MGs)
 	nx = len(MGs[0])
 
-	# get the connections to be drawn
 	text_lines: list[str] = []
 	for y in range(ny):
 		line = ""
@@ -252,6 +264,32 @@ def draw_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, max_intensi
 
 		text_lines.append(line)
 		text_lines.append(vert)
+	return text_lines
+
+def draw_connection_cell(draw: ImageDraw.ImageDraw, char: str, x: int, y: int):
+	""" Draws the connection line(s) for the given character from adjacency_text_lines() at the text position x, y. """
+	black = (0,0,0)
+	if char == "-":
+		draw.line([(x*20, y*20+10), (x*20+19, y*20+10)], fill=black)
+	if char == "|":
+		draw.line([(x*20+10, y*20), (x*20+10, y*20+19)], fill=black)
+	if char == "\\" or char == "X":
+		draw.line([(x*20, y*20), (x*20+19, y*20+19)], fill=black)
+	if char == "/" or char == "X":
+		draw.line([(x*20+19, y*20), (x*20, y*20+19)], fill=black)
+
+def rasterize_adjacency_matrix(MGs: list[list[MicroGrid]], max_intensity: Optional[int] = None, min_intensity: Optional[int] = None) -> Image.Image:
+	""" Draws the MG connections, with each MG colored by its intensity, and returns the image.
+
+	Arguments
+	---------
+	    max_intensity: if not None, then color each MG by its intensity and draw a colorbar
+	    min_intensity: the bottom value for the colorbar, defaults to the minimum MG intensity """
+	ny = len(MGs)
+	nx = len(MGs[0])
+
+	# get the connections to be drawn
+	text_lines = adjacency_text_lines(MGs)
 	# print("\n".join(text_lines))
 
 	# some basic stats
@@ -261,7 +299,9 @@ def draw_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, max_intensi
 	black = (0,0,0)
 	colorbar_width = 14
 	colorbar_extended = 40
-	min_intensity = max_intensity
+	find_min_intensity = min_intensity is None
+	if find_min_intensity:
+		min_intensity = max_intensity
 	if max_intensity is not None:
 		imgWidth += colorbar_extended
 
@@ -277,19 +317,11 @@ def draw_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, max_intensi
 				fill = None
 				MG = MGs[int(y/2)][int(x/2)]
 				if (max_intensity is not None and MG.intensity is not None):
-					min_intensity = min(min_intensity, MG.intensity)
-					r = int(255*(MG.intensity/max_intensity))
-					g = 255-r
-					fill = (r, g, 0)
+					if find_min_intensity:
+						min_intensity = min(min_intensity, MG.intensity)
+					fill = intensity_color(MG.intensity, max_intensity)
 				draw.ellipse((ex, ey, ex+15, ey+15), outline=black, fill=fill)
-			if char == "-":
-				draw.line([(x*20, y*20+10), (x*20+19, y*20+10)], fill=black)
-			if char == "|":
-				draw.line([(x*20+10, y*20), (x*20+10, y*20+19)], fill=black)
-			if char == "\\" or char == "X":
-				draw.line([(x*20, y*20), (x*20+19, y*20+19)], fill=black)
-			if char == "/" or char == "X":
-				draw.line([(x*20+19, y*20), (x*20, y*20+19)], fill=black)
+			draw_connection_cell(draw, char, x, y)
 
 	# draw the color bar
 	if max_intensity is not None:
@@ -319,4 +351,68 @@ def draw_adjacency_matrix(MGs: list[list[MicroGrid]], filename: str, max_intensi
 		draw.text((x1, y1-12), max_text, fill=black)
 		draw.text((x1, y2+1), min_text, fill=black)
 
-	img.save(filename)
\ No newline at end of file
+	return img
+
+class AdjacencyMatrixAnimator:
+	""" Renders many frames of the adjacency matrix image, one per set of node intensities.
+
+	The topology is only rasterized once. Each frame is a copy of that base image with the
+	inside of the node discs recolored through precomputed pixel masks. """
+	def __init__(self, MGs: list[list[MicroGrid]], max_intensity: float, min_intensity: float = 0):
+		ny = len(MGs)
+		nx = len(MGs[0])
+		self.nnodes = nx * ny
+		self.max_intensity = max_intensity
+
+		# the base image, with empty discs
+		intensities = [[mg.intensity for mg in row] for row in MGs]
+		for row in MGs:
+			for mg in row:
+				mg.intensity = None
+		self.base = np.asarray(rasterize_adjacency_matrix(MGs, max_intensity, min_intensity)).copy()
+		for y, row in enumerate(MGs):
+			for x, mg in enumerate(row):
+				mg.intensity = intensities[y][x]
+
+		# label each disc's pixels with its node index + 1, same placement as rasterize_adjacency_matrix()
+		labels_img = Image.new("I", (self.base.shape[1], self.base.shape[0]), color=0)
+		labels_draw = ImageDraw.Draw(labels_img)
+		for y in range(ny):
+			for x in range(nx):
+				ex, ey = x*40+2, y*40+2
+				labels_draw.ellipse((ex, ey, ex+15, ey+15), fill=y*nx+x+1)
+		labels = np.asarray(labels_img).reshape(-1)
+
+		# only recolor the inside of the discs, not the outlines
+		white = np.all(self.base.reshape(-1, 3) == 255, axis=1)
+		self.disc_pixels = np.nonzero((labels > 0) & white)[0]
+		self.disc_nodes = labels[self.disc_pixels] - 1
+
+	def render(self, node_intensities: np.ndarray) -> Image.Image:
+		""" Render one frame. node_intensities is indexed by node (y*nx+x), with NaN for no value. """
+		node_colors = np.full((self.nnodes+1, 3), 255, dtype=np.uint8)
+		has_value = ~np.isnan(node_intensities)
+		r = (255*(node_intensities[has_value]/self.max_intensity)).astype(int).clip(0, 255)
+		node_colors[:-1][has_value] = np.stack([r, 255-r, np.zeros_like(r)], axis=1)
+
+		frame = self.base.copy()
+		frame.reshape(-1, 3)[self.disc_pixels] = node_colors[self.disc_nodes]
+		return Image.fromarray(frame)
+
+def draw_adjacency_animation(MGs: list[list[MicroGrid]], intensities: np.ndarray, filename: str, max_intensity: float, frame_duration_ms: int = 100):
+	""" Saves an animation of the node intensities over time.
+
+	Arguments
+	---------
+	    intensities: one row per frame, one column per node (y*nx+x), NaN for no value
+	    filename: either a ".gif" file, or a directory to save the individual png frames to
+	    frame_duration_ms: how long to show each frame for in the gif """
+	animator = AdjacencyMatrixAnimator(MGs, max_intensity)
+	frames = [animator.render(node_intensities) for node_intensities in intensities]
+
+	if filename.endswith(".gif"):
+		frames[0].save(filename, save_all=True, append_images=frames[1:], duration=frame_duration_ms, loop=0)
+	else:
+		os.makedirs(filename, exist_ok=True)
+		for i, frame in enumerate(frames):
+			frame.save(os.path.join(filename, "frame_%05d.png" % i))
\ No newline at end of file
@@ -0,0 +1,224 @@
+# Streaming parser for ns-3 ASCII trace files (eg "20_n-node-ppp.tr").
+#
+# The trace is converted once into a compact binary event table, which can then
+# be memory mapped and queried by time range and node without rescanning the text.
+# Example trace line:
+#     + 2.0001 /NodeList/0/DeviceList/1/$ns3::PointToPointNetDevice/TxQueue/Enqueue ns3::PppHeader (...) ns3::Ipv4Header (... length: 540 10.0.0.1 > 10.0.0.2) ...
+import os
+import re
+import sys
+import numpy as np
+
+from tools import *
+
+# one row per trace event
+EVENT_DTYPE = np.dtype([
+	("time",   "<f8"), # simulation time, in seconds
+	("node",   "<i4"), # node the event happened on
+	("device", "<i2"), # device index on that node
+	("event",  "u1"),  # one of EVENT_ENQUEUE, EVENT_DEQUEUE, EVENT_RECEIVE, EVENT_DROP
+	("size",   "<i4"), # bytes on the wire, or -1 if the packet isn't an ip packet
+	("src",    "<i4"), # source node index, or -1 if unknown
+	("dst",    "<i4"), # destination node index, or -1 if unknown
+])
+
+EVENT_ENQUEUE = 0
+EVENT_DEQUEUE = 1
+EVENT_RECEIVE = 2
+EVENT_DROP = 3
+EVENT_TYPES = { "+": EVENT_ENQUEUE, "-": EVENT_DEQUEUE, "r": EVENT_RECEIVE, "d": EVENT_DROP }
+
+rpath = re.compile(r"/NodeList/(\d+)/DeviceList/(\d+)/")
+ripv4 = re.compile(r"length: (\d+) (\d+\.\d+\.\d+\.\d+) > (\d+\.\d+\.\d+\.\d+)")
+
+def read_node_interfaces(filename: str) -> dict[str, int]:
+	""" Reads the "20_node_interfaces.txt" file written by matrix-topology.cc.
+
+	Returns
+	-------
+	    dict( ip address, node index ) """
+	ret: dict[str, int] = {}
+	with open_file(filename, "r") as fin:
+		for i, line in enumerate(fin):
+			for addr in line.split():
+				if addr != "x":
+					ret[addr] = i
+	return ret
+
+def parse_trace_line(line: str, addr_nodes: dict[str, int]) -> Optional[tuple[float, int, int, int, int, int, int]]:
+	""" Parses a single ns-3 ASCII trace line into an event row.
+
+	Arguments
+	---------
+	    line: the trace line
+	    addr_nodes: the map from ip address to node index, from read_node_interfaces()
+
+	Returns
+	-------
+	    (time, node, device, event, size, src, dst), or None if the line isn't an event line. """
+	if len(line) < 2 or line[0] not in EVENT_TYPES or line[1] != " ":
+		return None
+	parts = line.split(" ", maxsplit=3)
+	if len(parts) < 3:
+		return None
+	path_match = rpath.match(parts[2])
+	if path_match is None:
+		return None
+
+	size, src, dst = -1, -1, -1
+	ip_match = ripv4.search(line)
+	if ip_match is not None:
+		size = int(ip_match.groups()[0])+2 # +2 for bytes on the wire
+		src = addr_nodes.get(ip_match.groups()[1], -1)
+		dst = addr_nodes.get(ip_match.groups()[2], -1)
+
+	return float(parts[1]), int(path_match.groups()[0]), int(path_match.groups()[1]), EVENT_TYPES[line[0]], size, src, dst
+
+def convert_trace(trace_filename: str, table_filename: str, addr_nodes: dict[str, int], chunk_size: int = 100_000) -> int:
+	""" Converts the ASCII trace into a binary event table in a single pass, then builds the index for it.
+
+	Arguments
+	---------
+	    trace_filename: the ns-3 ASCII trace to read
+	    table_filename: the binary event table to write, the index is written to table_filename+".idx.npz" and table_filename+".order.npy"
+	    addr_nodes: the map from ip address to node index, from read_node_interfaces()
+	    chunk_size: how many rows to buffer in memory before writing them out
+
+	Returns
+	-------
+	    The number of events written. """
+	nevents = 0
+	rows: list[tuple] = []
+	with open_file(trace_filename, "r") as fin, open(table_filename, "wb") as fout:
+		for line in fin:
+			row = parse_trace_line(line, addr_nodes)
+			if row is None:
+				continue
+			rows.append(row)
+			if len(rows) >= chunk_size:
+				np.array(rows, dtype=EVENT_DTYPE).tofile(fout)
+				nevents += len(rows)
+				rows = []
+		if len(rows) > 0:
+			np.array(rows, dtype=EVENT_DTYPE).tofile(fout)
+			nevents += len(rows)
+
+	build_index(table_filename, chunk_size)
+	return nevents
+
+def open_table(table_filename: str) -> np.ndarray:
+	""" Memory maps the given event table. """
+	if os.stat(table_filename).st_size == 0:
+		return np.zeros(0, dtype=EVENT_DTYPE)
+	return np.memmap(table_filename, dtype=EVENT_DTYPE, mode="r")
+
+def build_index(table_filename: str, chunk_size: int = 1_000_000):
+	""" Builds the time and node index for the given event table.
+
+	The table must already be sorted by time, which it is for ns-3 traces. The index is the
+	list of rows for each node, in time order, with node_offsets[n] the start of node n's rows.
+	The table is read chunk_size rows at a time, and the index is written through a memory map,
+	so that memory use doesn't depend on the size of the trace. """
+	events = open_table(table_filename)
+
+	# first pass: verify the time order, and count the rows per node
+	counts = np.zeros(0, dtype=np.int64)
+	last_time = -np.inf
+	for start in range(0, len(events), chunk_size):
+		chunk = events[start:start+chunk_size]
+		times = chunk["time"]
+		if times[0] < last_time or np.any(np.diff(times) < 0):
+			raise RuntimeError(f"Events in \"{table_filename}\" aren't in time order, near row {start}!")
+		last_time = times[-1]
+
+		chunk_counts = np.bincount(chunk["node"])
+		if len(chunk_counts) > len(counts):
+			counts = np.concatenate((counts, np.zeros(len(chunk_counts)-len(counts), dtype=np.int64)))
+		counts[:len(chunk_counts)] += chunk_counts
+	nnodes = len(counts)
+	node_offsets = np.zeros(nnodes+1, dtype=np.int64)
+	node_offsets[1:] = np.cumsum(counts)
+
+	# second pass: place each chunk's rows after the rows already placed for the same node
+	node_order = np.lib.format.open_memmap(table_filename + ".order.npy", mode="w+", dtype=np.int64, shape=(len(events),))
+	node_fill = node_offsets[:-1].copy()
+	for start in range(0, len(events), chunk_size):
+		nodes = np.asarray(events["node"][start:start+chunk_size])
+		order = np.argsort(nodes, kind="stable")
+		sorted_nodes = nodes[order]
+		chunk_counts = np.bincount(nodes, minlength=nnodes)
+		group_starts = np.cumsum(chunk_counts) - chunk_counts
+		dest = node_fill[sorted_nodes] + np.arange(len(nodes)) - group_starts[sorted_nodes]
+		node_order[dest] = start + order
+		node_fill += chunk_counts
+	node_order.flush()
+	del node_order
+
+	np.savez(table_filename + ".idx.npz", node_offsets=node_offsets)
+
+class TraceEvents:
+	""" Random access to a binary event table written by convert_trace(). """
+	def __init__(self, table_filename: str):
+		self.events = open_table(table_filename)
+		self.node_order: np.ndarray = np.load(table_filename + ".order.npy", mmap_mode="r")
+		with np.load(table_filename + ".idx.npz") as idx:
+			self.node_offsets: np.ndarray = idx["node_offsets"]
+		self.nnodes = len(self.node_offsets)-1
+
+	def query(self, start_time: float, end_time: float, node: Optional[int] = None, event: Optional[int] = None) -> np.ndarray:
+		""" Get all events with start_time <= time < end_time.
+
+		Arguments
+		---------
+		    node: if not None, then only return events for this node
+		    event: if not None, then only return events of this type (eg EVENT_DROP)
+
+		Returns
+		-------
+		    A structured array with the EVENT_DTYPE, in time order. """
+		if node is None:
+			times = self.events["time"]
+			start = np.searchsorted(times, start_time, side="left")
+			end = np.searchsorted(times, end_time, side="left")
+			ret = np.asarray(self.events[start:end])
+		else:
+			if node < 0 or node >= self.nnodes:
+				return np.zeros(0, dtype=EVENT_DTYPE)
+			rows = self.node_order[self.node_offsets[node]:self.node_offsets[node+1]]
+			times = self.events["time"][rows]
+			start = np.searchsorted(times, start_time, side="left")
+			end = np.searchsorted(times, end_time, side="left")
+			ret = self.events[rows[start:end]]
+
+		if event is not None:
+			ret = ret[ret["event"] == event]
+		return ret
+
+	def drop_counts(self, chunk_size: int = 1_000_000) -> np.ndarray:
+		""" Returns the number of dropped packets per node, indexed by node. """
+		ret = np.zeros(self.nnodes, dtype=np.int64)
+		for start in range(0, len(self.events), chunk_size):
+			chunk = self.events[start:start+chunk_size]
+			ret += np.bincount(chunk["node"][chunk["event"] == EVENT_DROP], minlength=self.nnodes)
+		return ret
+
+def main():
+	if len(sys.argv) < 2:
+		print(f"Usage: {sys.argv[0]} scratch_dir")
+		return
+	scratch_dir = sys.argv[1]
+	output_dir = os.path.join(scratch_dir, "output")
+
+	addr_nodes = read_node_interfaces(os.path.join(output_dir, "20_node_interfaces.txt"))
+	table_filename = os.path.join(output_dir, "20_n-node-ppp.events")
+	nevents = convert_trace(os.path.join(output_dir, "20_n-node-ppp.tr"), table_filename, addr_nodes)
+	print(f"Converted {nevents} events")
+
+	# report the nodes with the most drops
+	drop_counts = TraceEvents(table_filename).drop_counts()
+	for node in np.argsort(drop_counts)[::-1][:5]:
+		if drop_counts[node] > 0:
+			print(f"node {node}: {drop_counts[node]} drops")
+
+if __name__ == "__main__":
+	main()
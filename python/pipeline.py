@@ -0,0 +1,287 @@
+# Runs the 10 -> ns-3 -> 20 -> 30 stages, re-running only the stages whose inputs changed.
+#
+# Each stage declares its input files, output files, and parameters. Before a stage runs, those
+# are fingerprinted and compared to the fingerprint from the last successful run (kept in
+# "<work_dir>/pipeline_state.json"). Stages that don't depend on each other are run concurrently.
+#
+# Work directory layout:
+#     topology/            output of 10_main.py, shared by every scenario
+#     scenario_<n>/output/ the inputs and outputs for the simulation with n degrees of communication
+#     output_<n>           a link to scenario_<n>/output, as expected by 30_generate_graph.py
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any
+
+from tools import *
+
+python_dir = dir(os.path.abspath(__file__))
+repo_dir = dir(python_dir)
+
+class Stage:
+	def __init__(self, name: str, action: list[str]|Callable[['Stage'], None], inputs: list[str], outputs: list[str],
+	             params: Optional[dict[str, Any]] = None, deps: Optional[list[str]] = None, lock: Optional[str] = None):
+		""" One step of the pipeline.
+
+		Arguments
+		---------
+		    name: unique name for this stage
+		    action: either a command to run, or a function to call with this stage
+		    inputs: the files (or glob patterns) that this stage reads
+		    outputs: the files (or glob patterns) that this stage writes, the stage is re-run if any are missing
+		    params: any other values that affect this stage's outputs
+		    deps: the names of the stages that must finish before this one starts
+		    lock: stages with the same lock are never run at the same time """
+		self.name = name
+		self.action = action
+		self.inputs = inputs
+		self.outputs = outputs
+		self.params = params if params is not None else {}
+		self.deps = deps if deps is not None else []
+		self.lock = lock
+
+	def run(self):
+		if callable(self.action):
+			self.action(self)
+		else:
+			subprocess.run(self.action, check=True)
+
+	def outputs_exist(self) -> bool:
+		for pattern in self.outputs:
+			if len(glob.glob(pattern)) == 0:
+				return False
+		return True
+
+class Pipeline:
+	def __init__(self, stages: list[Stage], state_file: str, max_workers: int = 4):
+		self.stages: dict[str, Stage] = {}
+		for stage in stages:
+			if stage.name in self.stages:
+				raise RuntimeError(f"Duplicate stage {stage.name}!")
+			self.stages[stage.name] = stage
+		for stage in stages:
+			for dep in stage.deps:
+				if dep not in self.stages:
+					raise RuntimeError(f"Unknown dependency {dep} for stage {stage.name}!")
+
+		self.state_file = state_file
+		self.max_workers = max_workers
+		self.state: dict[str, dict] = { "stages": {}, "files": {} }
+		if os.path.exists(state_file):
+			with open(state_file, "r") as fin:
+				self.state = json.load(fin)
+		self.state_lock = threading.Lock()
+		self.stage_locks: dict[str, threading.Lock] = {}
+		for stage in stages:
+			if stage.lock is not None:
+				self.stage_locks[stage.lock] = threading.Lock()
+
+	def hash_file(self, filename: str) -> str:
+		""" Content hash of the given file, reusing the last hash if the size and mtime haven't changed. """
+		st = os.stat(filename)
+		key = os.path.abspath(filename)
+		with self.state_lock:
+			cached = self.state["files"].get(key)
+		if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+			return cached[2]
+
+		sha = hashlib.sha256()
+		with open(filename, "rb") as fin:
+			for block in iter(lambda: fin.read(1024*1024), b""):
+				sha.update(block)
+		digest = sha.hexdigest()
+		with self.state_lock:
+			self.state["files"][key] = [st.st_size, st.st_mtime_ns, digest]
+		return digest
+
+	def fingerprint(self, stage: Stage) -> str:
+		sha = hashlib.sha256()
+		action = stage.action.__name__ if callable(stage.action) else stage.action
+		sha.update(json.dumps([action, stage.params, stage.outputs], sort_keys=True).encode())
+		for pattern in stage.inputs:
+			filenames = sorted(glob.glob(pattern))
+			if len(filenames) == 0:
+				raise RuntimeError(f"Missing input {pattern} for stage {stage.name}!")
+			for filename in filenames:
+				sha.update(filename.encode())
+				sha.update(self.hash_file(filename).encode())
+		return sha.hexdigest()
+
+	def save_state(self):
+		with self.state_lock:
+			with open(self.state_file + ".tmp", "w") as fout:
+				json.dump(self.state, fout, indent=1)
+			os.replace(self.state_file + ".tmp", self.state_file)
+
+	def run_stage(self, stage: Stage, force: bool) -> bool:
+		""" Runs the stage if its inputs changed. Returns True if the stage was run. """
+		fingerprint = self.fingerprint(stage)
+		with self.state_lock:
+			last_fingerprint = self.state["stages"].get(stage.name)
+		if not force and fingerprint == last_fingerprint and stage.outputs_exist():
+			print(f"[{stage.name}] up to date")
+			return False
+
+		print(f"[{stage.name}] running")
+		if stage.lock is not None:
+			with self.stage_locks[stage.lock]:
+				stage.run()
+		else:
+			stage.run()
+
+		with self.state_lock:
+			self.state["stages"][stage.name] = fingerprint
+		self.save_state()
+		print(f"[{stage.name}] done")
+		return True
+
+	def run(self, force: Optional[list[str]] = None):
+		""" Runs all stages, as concurrently as the dependencies allow.
+
+		Arguments
+		---------
+		    force: names of stages to re-run even when their inputs haven't changed """
+		force = force if force is not None else []
+		done: set[str] = set()
+		running = {}
+
+		with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+			while len(done) < len(self.stages):
+				# start every stage whose dependencies are all done
+				for name, stage in self.stages.items():
+					if name in done or name in running.values():
+						continue
+					if all([dep in done for dep in stage.deps]):
+						running[pool.submit(self.run_stage, stage, name in force)] = name
+
+				if len(running) == 0:
+					raise RuntimeError("Circular stage dependencies!")
+
+				finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+				for future in finished:
+					name = running.pop(future)
+					future.result() # re-raise any errors from the stage
+					done.add(name)
+
+def copy_files(patterns: list[str], dest_dir: str):
+	os.makedirs(dest_dir, exist_ok=True)
+	for pattern in patterns:
+		for filename in glob.glob(pattern):
+			shutil.copy2(filename, dest_dir)
+
+def build_stages(work_dir: str, ns3_dir: str, degrees: list[int], seed: int = 1, ascii_trace: bool = False, ns3_command: list[str] = ["./ns3", "run", "scratch/matrix-topology"]) -> list[Stage]:
+	""" Describes the stages for all scenarios.
+
+	Arguments
+	---------
+	    work_dir: where to keep the outputs for all scenarios
+	    ns3_dir: the ns-3 directory, with the "scratch" directory in it
+	    degrees: one scenario is simulated per number of degrees of communication
+	    seed: the random seed for 10_main.py, so that re-running it generates the same topology
+	    ascii_trace: if True, then also rewrite the addresses in the ns-3 ASCII trace
+	    ns3_command: how to run matrix-topology.cc from the ns3_dir (eg "./waf --run" for older ns-3 versions) """
+	python = sys.executable
+	topology_dir = os.path.join(work_dir, "topology")
+	ns3_output_dir = os.path.join(ns3_dir, "scratch", "output")
+	topology_files = ["10_adjacency_matrix.png", "10_adjacency_matrix.txt", "10_node_coordinates.txt", "10_mgs_encoded.csv", "10_network_size.txt", "10_parameters.txt"]
+
+	def generate(stage: Stage):
+		os.makedirs(topology_dir, exist_ok=True)
+		subprocess.run([python, os.path.join(python_dir, "10_main.py"), topology_dir, str(stage.params["seed"])], check=True)
+
+	stages = [
+		Stage("generate", generate,
+		      inputs=[os.path.join(python_dir, "10_main.py"), os.path.join(python_dir, "MicroGrid.py"), os.path.join(python_dir, "tools.py")],
+		      outputs=[os.path.join(topology_dir, f) for f in topology_files],
+		      params={ "seed": seed })
+	]
+
+	for ndegrees in degrees:
+		scenario_dir = os.path.join(work_dir, f"scenario_{ndegrees}")
+		output_dir = os.path.join(scenario_dir, "output")
+
+		def configure(stage: Stage, ndegrees=ndegrees, output_dir=output_dir):
+			copy_files([os.path.join(topology_dir, f) for f in topology_files], output_dir)
+			with open(os.path.join(output_dir, "10_n_degrees.txt"), "w") as fout:
+				fout.write(f"{ndegrees}\n")
+			link = os.path.join(work_dir, f"output_{ndegrees}")
+			if not os.path.lexists(link):
+				os.symlink(os.path.relpath(output_dir, work_dir), link)
+
+		def simulate(stage: Stage, output_dir=output_dir):
+			# ns-3 always reads and writes "scratch/output", so only one simulation can run at a time
+			copy_files([os.path.join(output_dir, "10_*")], ns3_output_dir)
+			shutil.copy2(os.path.join(repo_dir, "matrix-topology.cc"), os.path.join(ns3_dir, "scratch"))
+			for filename in glob.glob(os.path.join(output_dir, "20_*")):
+				os.remove(filename)
+			subprocess.run(ns3_command, cwd=ns3_dir, check=True)
+			copy_files([os.path.join(ns3_output_dir, "20_*")], output_dir)
+
+		stages += [
+			Stage(f"configure_{ndegrees}", configure,
+			      inputs=[os.path.join(topology_dir, f) for f in topology_files],
+			      outputs=[os.path.join(output_dir, "10_n_degrees.txt")],
+			      params={ "ndegrees": ndegrees }, deps=["generate"]),
+			Stage(f"simulate_{ndegrees}", simulate,
+			      inputs=[os.path.join(output_dir, "10_*"), os.path.join(repo_dir, "matrix-topology.cc")],
+			      outputs=[os.path.join(output_dir, "20_*.pcap"), os.path.join(output_dir, "20_node_interfaces.txt")],
+			      params={ "ns3_dir": os.path.abspath(ns3_dir), "ns3_command": ns3_command }, deps=[f"configure_{ndegrees}"], lock="ns3"),
+			Stage(f"parse_pcaps_{ndegrees}", [python, os.path.join(python_dir, "20_parse_pcaps.py"), scenario_dir],
+			      inputs=[os.path.join(output_dir, "20_*.pcap"), os.path.join(python_dir, "20_parse_pcaps.py"), os.path.join(python_dir, "tools.py")],
+			      outputs=[os.path.join(output_dir, "20_pcap_ppp-*.csv")],
+			      deps=[f"simulate_{ndegrees}"]),
+		]
+		if ascii_trace:
+			stages.append(
+				Stage(f"replace_addresses_{ndegrees}", [python, os.path.join(python_dir, "30_replace_addresses.py"), scenario_dir],
+				      inputs=[os.path.join(output_dir, "20_n-node-ppp.tr"), os.path.join(output_dir, "20_node_interfaces.txt"), os.path.join(python_dir, "30_replace_addresses.py"),
+				              os.path.join(python_dir, "tools.py")],
+				      outputs=[os.path.join(output_dir, "30_n-node-ppp.tr")],
+				      deps=[f"simulate_{ndegrees}"]))
+
+	# 30_generate_graph.py runs over every scenario at once
+	graph_inputs = [os.path.join(python_dir, "30_generate_graph.py"), os.path.join(python_dir, "MicroGrid.py"), os.path.join(python_dir, "ns3_trace.py"),
+	                os.path.join(python_dir, "results_catalog.py"), os.path.join(python_dir, "tools.py")]
+	graph_outputs = []
+	for ndegrees in degrees:
+		graph_inputs.append(os.path.join(work_dir, f"output_{ndegrees}", "20_pcap_ppp-*.csv"))
+		graph_outputs.append(os.path.join(work_dir, f"output_{ndegrees}", "30_adjacency_matrix.png"))
+	def generate_graph(stage: Stage):
+		# 30_generate_graph.py imports from the "python" package
+		env = dict(os.environ)
+		env["PYTHONPATH"] = os.pathsep.join([repo_dir] + ([env["PYTHONPATH"]] if "PYTHONPATH" in env else []))
+		subprocess.run([python, os.path.join(python_dir, "30_generate_graph.py"), work_dir], env=env, check=True)
+
+	stages.append(
+		Stage("generate_graph", generate_graph,
+		      inputs=graph_inputs, outputs=graph_outputs,
+		      deps=[f"parse_pcaps_{ndegrees}" for ndegrees in degrees]))
+
+	return stages
+
+def main():
+	if len(sys.argv) < 3:
+		print(f"Usage: {sys.argv[0]} work_dir ns3_dir [stage_to_force]*")
+		return
+	work_dir = os.path.abspath(sys.argv[1])
+	ns3_dir = os.path.abspath(sys.argv[2])
+	force = sys.argv[3:]
+
+	# must match the degrees in 30_generate_graph.py
+	degrees = list(range(1, 6))
+
+	# change the seed to generate a different random topology
+	seed = 1
+
+	os.makedirs(work_dir, exist_ok=True)
+	stages = build_stages(work_dir, ns3_dir, degrees, seed)
+	Pipeline(stages, os.path.join(work_dir, "pipeline_state.json")).run(force)
+
+if __name__ == "__main__":
+	main()
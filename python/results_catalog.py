@@ -0,0 +1,180 @@
+# A local SQLite catalog of the results from every simulation run.
+#
+# 30_generate_graph.py records each run's parameters, per-node bandwidth, and per-link summaries
+# here, so that questions across many runs can be answered with a query instead of re-loading
+# every run's "node_sliding_windows.pickle".
+import os
+import sqlite3
+import sys
+import time
+
+from tools import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+	run_id           INTEGER PRIMARY KEY,
+	output_dir       TEXT NOT NULL,
+	results_id       TEXT NOT NULL,
+	created          REAL NOT NULL,
+	nx               INTEGER,
+	ny               INTEGER,
+	ndegrees         INTEGER,
+	side_conn_prob   INTEGER,
+	corner_conn_prob INTEGER,
+	seed             INTEGER,
+	UNIQUE (output_dir, results_id)
+);
+CREATE TABLE IF NOT EXISTS nodes (
+	run_id           INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+	node             INTEGER NOT NULL,
+	x                INTEGER NOT NULL,
+	y                INTEGER NOT NULL,
+	peak_bandwidth   REAL NOT NULL,
+	mean_bandwidth   REAL NOT NULL,
+	PRIMARY KEY (run_id, node)
+);
+CREATE TABLE IF NOT EXISTS links (
+	run_id           INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+	node             INTEGER NOT NULL,
+	peer             INTEGER NOT NULL,
+	bytes            INTEGER NOT NULL,
+	packets          INTEGER NOT NULL,
+	peak_rate        REAL NOT NULL,
+	PRIMARY KEY (run_id, node, peer)
+);
+CREATE INDEX IF NOT EXISTS runs_ndegrees ON runs(ndegrees, created);
+CREATE INDEX IF NOT EXISTS runs_created ON runs(created);
+CREATE INDEX IF NOT EXISTS nodes_peak ON nodes(peak_bandwidth, run_id);
+CREATE INDEX IF NOT EXISTS links_peak ON links(peak_rate, run_id);
+"""
+
+RUN_PARAMETERS = ["nx", "ny", "ndegrees", "side_conn_prob", "corner_conn_prob", "seed"]
+
+# bump this when the SCHEMA changes
+CATALOG_VERSION = 2
+
+def get_results_id(filename: str) -> str:
+	""" Identifies the results in the given file (eg "node_sliding_windows.pickle") by its size and mtime.
+
+	Output directories are re-used for every sweep, so this is what tells one run's results from the next. """
+	st = os.stat(filename)
+	return f"{st.st_size}-{st.st_mtime_ns}"
+
+def read_parameters(output_dir: str) -> dict[str, int]:
+	""" Reads the scenario parameters from the "10_*" files in the given output directory.
+
+	Parameters that can't be found (eg for runs from before "10_parameters.txt" existed) are left out. """
+	ret: dict[str, int] = {}
+	parameters_file = os.path.join(output_dir, "10_parameters.txt")
+	if os.path.exists(parameters_file):
+		with open(parameters_file, "r") as fin:
+			for line in fin:
+				if " " in line:
+					name, value = line.split(" ", maxsplit=1)
+					ret[name] = int(value)
+	with open(os.path.join(output_dir, "10_network_size.txt"), "r") as fin:
+		ret["ny"] = int(fin.readline())
+		ret["nx"] = int(fin.readline())
+	ndegrees_file = os.path.join(output_dir, "10_n_degrees.txt")
+	if os.path.exists(ndegrees_file):
+		with open(ndegrees_file, "r") as fin:
+			ret["ndegrees"] = int(fin.readline())
+	return ret
+
+class ResultsCatalog:
+	def __init__(self, filename: str):
+		self.conn = sqlite3.connect(filename)
+		self.conn.execute("PRAGMA foreign_keys = ON")
+		self.conn.execute("PRAGMA journal_mode = WAL")
+		version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+		ntables = self.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+		if ntables > 0 and version != CATALOG_VERSION:
+			raise RuntimeError(f"Catalog \"{filename}\" is from an older version, delete it to start a new one!")
+		self.conn.executescript(SCHEMA)
+		self.conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+	def close(self):
+		self.conn.close()
+
+	def has_run(self, output_dir: str, results_id: str) -> bool:
+		""" True if these results were already recorded with add_run(). """
+		row = self.conn.execute("SELECT 1 FROM runs WHERE output_dir = ? AND results_id = ?", (os.path.abspath(output_dir), results_id)).fetchone()
+		return row is not None
+
+	def add_run(self, output_dir: str, results_id: str, params: dict[str, int],
+	            node_stats: list[tuple[int, int, int, float, float]],
+	            link_stats: list[tuple[int, int, int, int, float]]) -> int:
+		""" Records the results for one run. If the same results were already recorded, then they're replaced.
+
+		Arguments
+		---------
+		    output_dir: the directory the run's results are in
+		    results_id: identifies the results in the output_dir, see get_results_id()
+		    params: the scenario parameters, see RUN_PARAMETERS
+		    node_stats: [(node, x, y, peak bandwidth, mean bandwidth)+]
+		    link_stats: [(node, peer node, bytes, packets, peak rate)+]
+
+		Returns
+		-------
+		    The run_id. """
+		output_dir = os.path.abspath(output_dir)
+		with self.conn:
+			self.conn.execute("DELETE FROM runs WHERE output_dir = ? AND results_id = ?", (output_dir, results_id))
+			cursor = self.conn.execute(
+				f"INSERT INTO runs (output_dir, results_id, created, {', '.join(RUN_PARAMETERS)}) VALUES (?, ?, ?{', ?' * len(RUN_PARAMETERS)})",
+				[output_dir, results_id, time.time()] + [params.get(name) for name in RUN_PARAMETERS])
+			run_id = cursor.lastrowid
+			self.conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", [(run_id,) + tuple(row) for row in node_stats])
+			self.conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?)", [(run_id,) + tuple(row) for row in link_stats])
+		return run_id
+
+	def runs_above(self, min_peak_bandwidth: float, ndegrees: Optional[int] = None, last_n_runs: Optional[int] = None) -> list[tuple[int, str, int, int, float]]:
+		""" Finds the runs with at least one node at or above the given peak bandwidth.
+
+		Arguments
+		---------
+		    ndegrees: if not None, then only check runs with this many degrees of communication
+		    last_n_runs: if not None, then only check this many of the most recent (matching) runs
+
+		Returns
+		-------
+		    [(run_id, output_dir, ndegrees, node, peak bandwidth)+] for the highest node of each matching run """
+		where = "" if ndegrees is None else "WHERE ndegrees = ?"
+		args: list = [] if ndegrees is None else [ndegrees]
+		limit = "" if last_n_runs is None else "LIMIT ?"
+		args += [] if last_n_runs is None else [last_n_runs]
+		args.append(min_peak_bandwidth)
+		return self.conn.execute(f"""
+			SELECT r.run_id, r.output_dir, r.ndegrees, n.node, MAX(n.peak_bandwidth)
+			FROM (SELECT * FROM runs {where} ORDER BY created DESC {limit}) r
+			JOIN nodes n ON n.run_id = r.run_id
+			WHERE n.peak_bandwidth >= ?
+			GROUP BY r.run_id
+			ORDER BY r.created DESC""", args).fetchall()
+
+	def peak_by_degree(self) -> dict[int, float]:
+		""" The highest node peak bandwidth of each run, averaged over all runs with the same number of degrees. """
+		rows = self.conn.execute("""
+			SELECT ndegrees, AVG(run_peak) FROM (
+				SELECT r.ndegrees AS ndegrees, MAX(n.peak_bandwidth) AS run_peak
+				FROM runs r JOIN nodes n ON n.run_id = r.run_id
+				WHERE r.ndegrees IS NOT NULL
+				GROUP BY r.run_id
+			) GROUP BY ndegrees ORDER BY ndegrees""").fetchall()
+		return { ndegrees: peak for ndegrees, peak in rows }
+
+def main():
+	if len(sys.argv) < 3:
+		print(f"Usage: {sys.argv[0]} catalog_file min_peak_bandwidth [ndegrees [last_n_runs]]")
+		return
+	catalog = ResultsCatalog(sys.argv[1])
+	min_peak_bandwidth = float(sys.argv[2])
+	ndegrees = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	last_n_runs = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+	for run_id, output_dir, run_ndegrees, node, peak in catalog.runs_above(min_peak_bandwidth, ndegrees, last_n_runs):
+		print(f"{output_dir} ({run_ndegrees} degrees): node {node} peaked at {peak/1_000_000:.2f} MB/s")
+	catalog.close()
+
+if __name__ == "__main__":
+	main()
@@ -1,4 +1,7 @@
 from random import randint
+import gzip
+import io
+import lzma
 import os
 from typing import Optional, Callable, TypeVar
 
@@ -32,4 +35,59 @@ def decode_next(sval: str, conversion: Optional[Callable[[str], A]] = None) -> t
 
 	if conversion != None:
 		parts[0] = conversion(parts[0])
-	return parts[0], parts[1]
\ No newline at end of file
+	return parts[0], parts[1]
+
+# magic numbers at the start of compressed files
+GZIP_MAGIC = b"\x1f\x8b"
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+
+# read and write compressed files in large blocks, so that they're about as fast as plain files
+BLOCK_SIZE = 1024*1024
+
+def get_compression(filename: str) -> Optional[str]:
+	""" Returns "gzip", "lzma", or None, depending on the contents of the given file. """
+	with open(filename, "rb") as fin:
+		magic = fin.read(len(LZMA_MAGIC))
+	if magic.startswith(GZIP_MAGIC):
+		return "gzip"
+	if magic.startswith(LZMA_MAGIC):
+		return "lzma"
+	return None
+
+def open_file(filename: str, mode: str = "r", compression: Optional[str] = None) -> io.IOBase:
+	""" Opens a file for streaming reads or writes, with optional compression.
+
+	Compressed files keep their regular filename, so that the rest of the pipeline doesn't need to know about them.
+
+	Arguments
+	---------
+	    filename: the file to open
+	    mode: one of "r", "rb", "w", "wb", "a", or "ab"
+	    compression: when writing, one of None, "gzip", or "lzma". When reading, this is detected from the file contents.
+
+	Returns
+	-------
+	    A file object for the (uncompressed) contents of the file. """
+	binary = "b" in mode
+	rw = mode.replace("b", "").replace("t", "")
+	if rw not in ["r", "w", "a"]:
+		raise RuntimeError(f"Unsupported mode \"{mode}\"")
+	if rw == "r":
+		compression = get_compression(filename)
+
+	if compression is None:
+		return open(filename, rw + ("b" if binary else ""), buffering=BLOCK_SIZE)
+	elif compression == "gzip":
+		compressed = gzip.open(filename, rw + "b", compresslevel=6)
+	elif compression == "lzma":
+		compressed = lzma.open(filename, rw + "b")
+	else:
+		raise RuntimeError(f"Unknown compression \"{compression}\"")
+
+	if rw == "r":
+		buffered = io.BufferedReader(compressed, buffer_size=BLOCK_SIZE)
+	else:
+		buffered = io.BufferedWriter(compressed, buffer_size=BLOCK_SIZE)
+	if binary:
+		return buffered
+	return io.TextIOWrapper(buffered, encoding="utf-8")
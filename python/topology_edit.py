@@ -0,0 +1,160 @@
+# Incremental edits to an existing topology (eg from "10_mgs_encoded.csv").
+#
+# Links are cut or added with TopologyEdit, which keeps both directions of each link consistent
+# and records the change set. The change set is then applied to the existing output files by
+# rewriting only the affected parts of them, instead of regenerating everything with 10_main.py.
+from PIL import Image, ImageDraw
+
+from MicroGrid import *
+from tools import *
+
+class TopologyEdit:
+	def __init__(self, MGs: list[list[MicroGrid]]):
+		self.MGs = MGs
+		self.ny = len(MGs)
+		self.nx = len(MGs[0])
+
+		# (node a, node b) -> (original is_connected, new is_connected), with a < b
+		# The original is None if the two MGs didn't agree on whether they were connected.
+		self.changes: dict[tuple[int, int], tuple[Optional[bool], bool]] = {}
+
+	@staticmethod
+	def from_encoded(filename: str) -> 'TopologyEdit':
+		return TopologyEdit(read_encoded_mgs(filename))
+
+	def _get_link(self, x: int, y: int, rel_x_or_dir: int|str, rel_y: Optional[int] = None) -> tuple[MicroGrid, MicroGrid, int, int]:
+		if isinstance(rel_x_or_dir, str):
+			rel_x, rel_y = self.MGs[y][x].connections._get_rel_position(rel_x_or_dir)
+		else:
+			rel_x: int = rel_x_or_dir
+			rel_y: int = rel_y
+		if rel_x < -1 or rel_y < -1 or rel_x > 1 or rel_y > 1 or (rel_x == 0 and rel_y == 0):
+			raise RuntimeError(f"Can't link MG {x},{y} to relative position {rel_x},{rel_y}!")
+		ox, oy = x+rel_x, y+rel_y
+		if x < 0 or y < 0 or x >= self.nx or y >= self.ny or ox < 0 or oy < 0 or ox >= self.nx or oy >= self.ny:
+			raise RuntimeError(f"Link from MG {x},{y} to MG {ox},{oy} is outside the {self.nx}x{self.ny} grid!")
+		return self.MGs[y][x], self.MGs[oy][ox], rel_x, rel_y
+
+	def set_link(self, is_connected: bool, x: int, y: int, rel_x_or_dir: int|str, rel_y: Optional[int] = None):
+		""" Connects or disconnects the MG at x, y and its neighbor in the given direction, in both directions. """
+		MG, other, rel_x, rel_y = self._get_link(x, y, rel_x_or_dir, rel_y)
+		# 10_main.py doesn't sync every link, so only one side might have it. ns-3 builds the link if either side does.
+		connected, other_connected = MG.is_connected(rel_x, rel_y), other.is_connected(-rel_x, -rel_y)
+		MG.set_connected(is_connected, rel_x, rel_y)
+		other.set_connected(is_connected, -rel_x, -rel_y)
+
+		# record the change, dropping it if it undoes a previous change
+		a, b = MG.y*self.nx + MG.x, other.y*self.nx + other.x
+		link = (min(a, b), max(a, b))
+		if link in self.changes:
+			original = self.changes[link][0]
+		elif connected == other_connected:
+			original = connected
+		else:
+			original = None # always rewrite a one-sided link, so that both sides agree in the files
+		if original == is_connected:
+			self.changes.pop(link, None)
+		else:
+			self.changes[link] = (original, is_connected)
+
+	def add_link(self, x: int, y: int, rel_x_or_dir: int|str, rel_y: Optional[int] = None):
+		self.set_link(True, x, y, rel_x_or_dir, rel_y)
+
+	def cut_link(self, x: int, y: int, rel_x_or_dir: int|str, rel_y: Optional[int] = None):
+		self.set_link(False, x, y, rel_x_or_dir, rel_y)
+
+	def _node_xy(self, node: int) -> tuple[int, int]:
+		return node % self.nx, node // self.nx
+
+	def _cell_char(self, cx: int, cy: int) -> str:
+		""" The adjacency_text_lines() character at the text position cx, cy, computed for just that cell. """
+		MG = self.MGs[cy//2][cx//2]
+		if cy % 2 == 0:
+			return "-" if MG.is_connected("east") else " "
+		if cx % 2 == 0:
+			return "|" if MG.is_connected("south") else " "
+		se = MG.is_connected("southeast")
+		sw = self.MGs[cy//2][cx//2+1].is_connected("southwest")
+		if se and sw:
+			return "X"
+		return "\\" if se else ("/" if sw else " ")
+
+	def patch_adjacency_matrix(self, filename: str):
+		""" Updates the entries for the changed links in an adjacency matrix file from create_adjacency_matrix(). """
+		ntotal = self.nx * self.ny
+		row_width = ntotal*2 + 1 # "0 " or "1 " per column, plus the newline
+		self._check_uncompressed(filename)
+		if os.stat(filename).st_size != ntotal*row_width - 1:
+			raise RuntimeError(f"Adjacency matrix \"{filename}\" doesn't match the {self.nx}x{self.ny} grid!")
+
+		# Each link is kept only from the lower to the higher node index. A link that only the higher
+		# node had is written from the higher to the lower index instead, so clear that entry too.
+		with open(filename, "r+b") as fout:
+			for (a, b), (_, is_connected) in sorted(self.changes.items()):
+				fout.seek(a*row_width + b*2)
+				fout.write(b"1" if is_connected else b"0")
+				fout.seek(b*row_width + a*2)
+				fout.write(b"0")
+
+	def patch_encoded_mgs(self, filename: str):
+		""" Updates the lines for the changed MGs in a file from write_encoded_mgs().
+
+		The connections are written as "True" or "False", so the lines don't have a fixed width and
+		finding them takes a scan of the file. If every changed line keeps its length, then those lines
+		are overwritten in place. Otherwise (eg for any cut or added link) the file is streamed into a
+		new copy with the changed lines replaced. Either way the cost is O(file size), not O(changes). """
+		self._check_uncompressed(filename)
+		changed_lines: dict[int, bytes] = {}
+		for a, b in self.changes:
+			for node in (a, b):
+				x, y = self._node_xy(node)
+				changed_lines[1 + node] = (self.MGs[y][x].encode() + "\n").encode()
+
+		# find the changed lines
+		offsets: dict[int, int] = {}
+		same_length = True
+		nlines, offset = 0, 0
+		with open(filename, "rb") as fin:
+			for i, line in enumerate(fin):
+				if i in changed_lines:
+					offsets[i] = offset
+					same_length = same_length and len(line) == len(changed_lines[i])
+				offset += len(line)
+				nlines += 1
+		if nlines != self.nx*self.ny + 1:
+			raise RuntimeError(f"Encoded MGs \"{filename}\" don't match the {self.nx}x{self.ny} grid!")
+
+		if same_length:
+			with open(filename, "r+b") as fout:
+				for i, offset in sorted(offsets.items()):
+					fout.seek(offset)
+					fout.write(changed_lines[i])
+		else:
+			with open(filename, "rb") as fin, open(filename + ".tmp", "wb") as fout:
+				for i, line in enumerate(fin):
+					fout.write(changed_lines.get(i, line))
+			os.replace(filename + ".tmp", filename)
+
+	def patch_adjacency_image(self, filename: str):
+		""" Redraws the cells for the changed links in an image from draw_adjacency_matrix(). """
+		img = Image.open(filename).convert("RGB")
+		draw = ImageDraw.Draw(img)
+		white = (255,255,255)
+		for a, b in self.changes:
+			ax, ay = self._node_xy(a)
+			bx, by = self._node_xy(b)
+			cx, cy = ax+bx, ay+by
+			draw.rectangle(((cx*20, cy*20), (cx*20+19, cy*20+19)), fill=white)
+			draw_connection_cell(draw, self._cell_char(cx, cy), cx, cy)
+		img.save(filename)
+
+	def _check_uncompressed(self, filename: str):
+		if get_compression(filename) is not None:
+			raise RuntimeError(f"Can't patch compressed file \"{filename}\", regenerate it instead!")
+
+	def apply(self, output_dir: str):
+		""" Patches the "10_*" topology files in the given directory with the recorded changes, then clears them. """
+		self.patch_adjacency_matrix(os.path.join(output_dir, "10_adjacency_matrix.txt"))
+		self.patch_encoded_mgs(os.path.join(output_dir, "10_mgs_encoded.csv"))
+		self.patch_adjacency_image(os.path.join(output_dir, "10_adjacency_matrix.png"))
+		self.changes = {}